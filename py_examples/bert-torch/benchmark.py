@@ -0,0 +1,71 @@
+# Copyright 2022 netease. All rights reserved.
+# Author zhaochaochao@corp.netease.com
+# Date   2024/7/1
+# Brief  Benchmark cpu accuracy and throughput of bert model in different precisions against fp32.
+
+import timeit
+
+import numpy as np
+import torch
+from transformers import AutoModelForMaskedLM, AutoTokenizer
+
+TEXT = '[CLS] 中国的首都是哪里？ [SEP] 北京是 [MASK] 国的首都。 [SEP]'  # Same as test.py.
+BENCHMARK_BATCH_SIZES = [1, 4, 16]
+BENCHMARK_PRECISIONS = ['fp32', 'bf16', 'int8_dynamic']  # Same as `precision` of inferer_args.
+
+
+def load_model(precision):
+    """load model in given precision, same as src/customized_inferer.py."""
+    model = AutoModelForMaskedLM.from_pretrained("google-bert/bert-base-chinese").eval()
+    if precision == 'bf16':
+        model.to(torch.bfloat16)
+    elif precision == 'int8_dynamic':
+        model = torch.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+    return model
+
+
+def infer(model, input_ids):
+    with torch.no_grad():
+        return model(input_ids)[0].float()
+
+
+def benchmark(model, input_ids, batch_size):
+    """benchmark latency of model with given batch size, returns median latency in ms."""
+    timing_number = 10
+    timing_repeat = 5
+    input_ids = input_ids.repeat(batch_size, 1)
+    infer(model, input_ids)  # warmup
+    speed = (
+            np.array(timeit.Timer(lambda: infer(model, input_ids))
+                     .repeat(repeat=timing_repeat, number=timing_number))
+            * 1000 / timing_number
+    )
+    return np.median(speed)
+
+
+if __name__ == '__main__':
+    print('torch version: {}, threads: {}'.format(torch.__version__, torch.get_num_threads()))
+    tokenizer = AutoTokenizer.from_pretrained("google-bert/bert-base-chinese")
+    input_ids = torch.LongTensor([tokenizer.convert_tokens_to_ids(tokenizer.tokenize(TEXT))])
+    mask_pos = input_ids[0].tolist().index(tokenizer.mask_token_id)
+
+    fp32_out = None
+    for precision in BENCHMARK_PRECISIONS:
+        try:
+            model = load_model(precision)
+            out = infer(model, input_ids)
+        except RuntimeError as e:  # Precision may be not supported by current torch or cpu.
+            print('precision: {}, not supported: {}'.format(precision, e))
+            continue
+        if fp32_out is None:
+            fp32_out = out
+
+        # confirm accuracy against fp32 model
+        pred = tokenizer.convert_ids_to_tokens([out[0][mask_pos].argmax().item()])[0]
+        agreement = (out.argmax(2) == fp32_out.argmax(2)).float().mean().item()
+        print('precision: {}, mask prediction: {}, token agreement with fp32: {:.2%}'.format(
+            precision, pred, agreement))
+        for batch_size in BENCHMARK_BATCH_SIZES:
+            latency = benchmark(model, input_ids, batch_size)
+            print('precision: {}, batch_size: {}, latency: {:.2f} ms, throughput: {:.2f} seq/s'
+                  .format(precision, batch_size, latency, batch_size * 1000 / latency))
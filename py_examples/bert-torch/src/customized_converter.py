@@ -2,10 +2,14 @@
 # Author zhaochaochao@corp.netease.com
 # Date   2023/9/5
 # Brief  Customized converter of model, including pre-process and post-process.
+import time
+
 from grps_framework.apis.grps_pb2 import GrpsMessage
+from grps_framework.conf.conf import global_conf
 from grps_framework.context.context import GrpsContext
 from grps_framework.converter.converter import Converter, converter_register
 from grps_framework.logger.logger import clogger
+from grps_framework.model_infer.inferer import inferer_register
 from transformers import AutoTokenizer
 import torch
 
@@ -18,6 +22,7 @@ class YourConverter(Converter):
         self.model_name = 'bert-base-chinese'
         self.tokenizer = None
         self.mask_token_id = 0
+        self.seq_len_bucket = 16
 
     def init(self, path=None, args=None):
         """
@@ -35,8 +40,103 @@ class YourConverter(Converter):
         clogger.info('your converter init, path: {}, args: {}'.format(path, args))
 
         self.mask_token_id = args['mask_token_id']
+        self.seq_len_bucket = args.get('seq_len_bucket', self.seq_len_bucket)
+        if type(self.seq_len_bucket) is not int or self.seq_len_bucket <= 0:
+            raise ValueError('Invalid seq_len_bucket: {}, should be positive int.'.format(self.seq_len_bucket))
         self.tokenizer = AutoTokenizer.from_pretrained("google-bert/bert-base-chinese")
 
+        # Model inferer has been loaded before converter init, so warmup here will finish before service is ready.
+        warmup = args.get('warmup')
+        if warmup:
+            self.__warmup(args.get('model'), warmup)
+
+    def __warmup(self, model, warmup):
+        """
+        Warmup model inferer with every combination of batch size and sequence length bucket, so that first requests
+        will not pay for cuda allocator growth and kernel selection of new shapes. Dynamic batcher has not started when
+        converter init, so warmup calls model inferer directly with the shapes that batch_preprocess builds, one forward
+        per bucket padded to its upper bound. Shapes not covered(batch sizes not listed, buckets padded to shorter
+        lengths, sequences longer than `max_seq_len`) may still be slow the first time.
+
+        Args:
+            model: Model(name-version format) bound with this converter.
+            warmup: Warmup config with `batch_sizes`, `max_seq_len` and `iterations`.
+
+        Raises:
+            ValueError: If warmup config is invalid.
+        """
+        batch_sizes = warmup.get('batch_sizes', [1])
+        max_seq_len = warmup.get('max_seq_len', self.seq_len_bucket)
+        iterations = warmup.get('iterations', 1)
+        if type(batch_sizes) is not list or not batch_sizes or \
+                any(type(size) is not int or size <= 0 for size in batch_sizes):
+            raise ValueError('Invalid warmup batch_sizes: {}, should be list of positive int.'.format(batch_sizes))
+        if type(max_seq_len) is not int or not 2 <= max_seq_len <= self.tokenizer.model_max_length:
+            raise ValueError('Invalid warmup max_seq_len: {}, should be int in [2, {}].'.format(
+                max_seq_len, self.tokenizer.model_max_length))
+        if type(iterations) is not int or iterations <= 0:
+            raise ValueError('Invalid warmup iterations: {}, should be positive int.'.format(iterations))
+
+        inferer = None
+        for model_desc in global_conf.inference_conf['models']:
+            if '{}-{}'.format(model_desc.get('name'), model_desc.get('version')) == model:
+                inferer = inferer_register.get_model_inferer(model_desc.get('inferer_name'))
+                break
+        if inferer is None:
+            raise ValueError('Invalid model: {}, should be customized model declared in models.'.format(model))
+
+        max_bucket = (max_seq_len + self.seq_len_bucket - 1) // self.seq_len_bucket
+        for bucket in range(1, max_bucket + 1):
+            # Longest sequence of the bucket, which is the padded length of the bucket.
+            seq_len = min(bucket * self.seq_len_bucket, self.tokenizer.model_max_length)
+            row = [self.tokenizer.cls_token_id] + [self.mask_token_id] * (seq_len - 2) + [self.tokenizer.sep_token_id]
+            for batch_size in batch_sizes:
+                latencies = []
+                for _ in range(iterations):
+                    begin = time.time()
+                    inferer.batch_infer({bucket: self.__pad([row] * batch_size)}, [GrpsContext()] * batch_size)
+                    latencies.append(time.time() - begin)
+                clogger.info('your converter warmup, model: {}, batch size: {}, seq len: {}, iterations: {}, '
+                             'first latency: {:.0f} us, last latency: {:.0f} us'.format(
+                                 model, batch_size, seq_len, iterations, latencies[0] * 1e6, latencies[-1] * 1e6))
+
+    def __tokenize(self, text, context: GrpsContext):
+        """Tokenize text to input ids, and save mask positions into context."""
+        input_ids = self.tokenizer.convert_tokens_to_ids(self.tokenizer.tokenize(text))
+
+        mask_pos = []
+        for i in range(0, len(input_ids)):
+            if input_ids[i] == self.mask_token_id:
+                mask_pos.append(i)
+        context.put_user_data('mask_pos', mask_pos)
+        clogger.info('your converter preprocess, mask_pos: {}'.format(mask_pos))
+        return input_ids
+
+    def __build_out(self, pred, context: GrpsContext) -> GrpsMessage:
+        """Build output message with predicted tokens of mask positions."""
+        output = self.tokenizer.convert_ids_to_tokens(pred)
+
+        out = GrpsMessage()
+        mask_pos = context.get_user_data('mask_pos')
+        clogger.info('your converter postprocess, mask_pos: {}'.format(mask_pos))
+        out.str_data = ''
+        for pos in mask_pos:
+            if out.str_data != '':
+                out.str_data += '||'
+            out.str_data += output[pos]
+
+        return out
+
+    def __pad(self, rows):
+        """Pad input ids rows of one bucket to the longest row, and build attention mask."""
+        seq_len = max([len(row) for row in rows])
+        input_ids = torch.full((len(rows), seq_len), self.tokenizer.pad_token_id, dtype=torch.long)
+        attention_mask = torch.zeros((len(rows), seq_len), dtype=torch.long)
+        for i, row in enumerate(rows):
+            input_ids[i, :len(row)] = torch.LongTensor(row)
+            attention_mask[i, :len(row)] = 1
+        return {'input_ids': input_ids, 'attention_mask': attention_mask}
+
     def preprocess(self, inp: GrpsMessage, context: GrpsContext):
         """
         Preprocess.
@@ -52,18 +152,8 @@ class YourConverter(Converter):
             Exception: If preprocess failed, can raise exception and exception will be caught by server and return error
             message to client.
         """
-        samples = [inp.str_data]
-        tokenizer_text = [self.tokenizer.tokenize(i) for i in samples]
-        input_ids = [self.tokenizer.convert_tokens_to_ids(i) for i in tokenizer_text]
-
-        mask_pos = []
-        for i in range(0, len(input_ids[0])):
-            if input_ids[0][i] == self.mask_token_id:
-                mask_pos.append(i)
-        context.put_user_data('mask_pos', mask_pos)
-        clogger.info('your converter preprocess, mask_pos: {}'.format(mask_pos))
-
-        input_ids = torch.LongTensor(input_ids)
+        input_ids = self.__tokenize(inp.str_data, context)
+        input_ids = torch.LongTensor([input_ids])
         return {'input_ids': input_ids}
 
     def postprocess(self, inp, context: GrpsContext) -> GrpsMessage:
@@ -78,22 +168,62 @@ class YourConverter(Converter):
             Post-processed data with GrpsMessage format to client or next model(multi model sequential mode).
 
         Raises:
-            Exception: If postprocess failed, can raise exception and exception will be caught by server and return error
+            Exception: If postprocess failed, can raise exception and exception will be caught by server and return
+            error message to client.
+        """
+        return self.__build_out(inp['pred'], context)
+
+    def batch_preprocess(self, inps: list, contexts: list):
+        """
+        Batch preprocess. Requests are grouped into buckets by sequence length(rounded up to `seq_len_bucket`), and
+        each bucket is only padded to the longest sequence of itself, so short requests will not be padded to the
+        longest one of the whole batch.
+
+        Args:
+            inps: Input messages from client or previous model(multi model sequential mode).
+            contexts: Grps contexts of current requests.
+
+        Returns:
+            Pre-processed data which is input of model inferer. Dict with bucket as key and padded `input_ids` and
+            `attention_mask` of the bucket as value.
+
+        Raises:
+            Exception: If preprocess failed, can raise exception and exception will be caught by server and return error
             message to client.
         """
-        pred = inp['pred']
-        output = self.tokenizer.convert_ids_to_tokens(pred)
+        buckets = {}
+        for inp, context in zip(inps, contexts):
+            input_ids = self.__tokenize(inp.str_data, context)
+            bucket = (len(input_ids) + self.seq_len_bucket - 1) // self.seq_len_bucket
+            rows = buckets.setdefault(bucket, [])
+            context.put_user_data('batch_idx', (bucket, len(rows)))
+            rows.append(input_ids)
+
+        batch = {bucket: self.__pad(rows) for bucket, rows in buckets.items()}
+        clogger.info('your converter batch_preprocess, batch size: {}, bucket sizes: {}'.format(
+            len(inps), {bucket * self.seq_len_bucket: len(rows) for bucket, rows in buckets.items()}))
+        return batch
+
+    def batch_postprocess(self, inp, contexts: list) -> list:
+        """
+        Batch postprocess.
 
-        out = GrpsMessage()
-        mask_pos = context.get_user_data('mask_pos')
-        clogger.info('your converter postprocess, mask_pos: {}'.format(mask_pos))
-        out.str_data = ''
-        for pos in mask_pos:
-            if out.str_data != '':
-                out.str_data += '||'
-            out.str_data += output[pos]
+        Args:
+            inp: Input to be post-processed, which is output of model inferer.
+            contexts: Grps contexts of current requests.
 
-        return out
+        Returns:
+            Post-processed data with GrpsMessage format to client or next model(multi model sequential mode).
+
+        Raises:
+            Exception: If postprocess failed, can raise exception and exception will be caught by server and return
+            error message to client.
+        """
+        outs = []
+        for context in contexts:
+            bucket, row = context.get_user_data('batch_idx')
+            outs.append(self.__build_out(inp['pred'][bucket][row], context))
+        return outs
 
 
 converter_register.register('your_converter', YourConverter())
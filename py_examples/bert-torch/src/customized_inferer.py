@@ -2,6 +2,8 @@
 # Author zhaochaochao@corp.netease.com
 # Date   2023/9/5
 # Brief  Customized deep learning model inferer. Including model load and model infer.
+import os
+
 from grps_framework.context.context import GrpsContext
 from grps_framework.model_infer.inferer import ModelInferer, inferer_register
 from grps_framework.logger.logger import clogger
@@ -15,6 +17,7 @@ class YourInferer(ModelInferer):
         super().__init__()
         self.model_name = 'bert-base-chinese'
         self.model = None
+        self.precision = 'fp32'
 
     def init(self, path, device=None, args=None):
         """
@@ -38,6 +41,37 @@ class YourInferer(ModelInferer):
             self._device = 'cpu'
         else:
             raise ValueError('Invalid device: {}, must be cuda, gpu or cpu.'.format(device))
+        self.precision = (args or {}).get('precision', self.precision)
+        if self.precision not in ['fp32', 'bf16', 'int8_dynamic']:
+            raise ValueError('Invalid precision: {}, should be fp32, bf16 or int8_dynamic.'.format(self.precision))
+        if self.precision != 'fp32' and self._device != 'cpu':
+            raise ValueError('Invalid precision: {}, only supported when device is cpu.'.format(self.precision))
+
+        # Thread budget and cpu pinning. Torch thread pools are process wide. Cpu affinity is per thread on linux, so
+        # pin every existing thread(like monitor and mpi threads started before model init), threads created
+        # later(batcher, converter workers) inherit the affinity.
+        intra_op_threads = (args or {}).get('intra_op_threads')
+        inter_op_threads = (args or {}).get('inter_op_threads')
+        cpu_affinity = (args or {}).get('cpu_affinity')
+        for name, threads in (('intra_op_threads', intra_op_threads), ('inter_op_threads', inter_op_threads)):
+            if threads is not None and (type(threads) is not int or threads <= 0):
+                raise ValueError('Invalid {}: {}, should be positive int.'.format(name, threads))
+        if cpu_affinity is not None:
+            if type(cpu_affinity) is not list or not cpu_affinity or \
+                    any(type(cpu) is not int or cpu < 0 for cpu in cpu_affinity):
+                raise ValueError('Invalid cpu_affinity: {}, should be list of cpu ids.'.format(cpu_affinity))
+            for tid in os.listdir('/proc/self/task'):
+                try:
+                    os.sched_setaffinity(int(tid), cpu_affinity)
+                except ProcessLookupError:  # Thread has exited.
+                    pass
+        if intra_op_threads:
+            torch.set_num_threads(intra_op_threads)
+        if inter_op_threads:
+            torch.set_num_interop_threads(inter_op_threads)
+        clogger.info('your infer thread topology, cpu count: {}, cpu affinity: {}, intra-op threads: {}, '
+                     'inter-op threads: {}'.format(os.cpu_count(), sorted(os.sched_getaffinity(0)),
+                                                   torch.get_num_threads(), torch.get_num_interop_threads()))
         clogger.info('your infer init, path: {}, device: {}, args: {}.'.format(path, device, args))
 
     def load(self):
@@ -53,7 +87,11 @@ class YourInferer(ModelInferer):
         """
         self.model = AutoModelForMaskedLM.from_pretrained("google-bert/bert-base-chinese").to(self._device)
         self.model.eval()
-        clogger.info('your inferer loaded, path: {}'.format(self._path))
+        if self.precision == 'bf16':
+            self.model.to(torch.bfloat16)
+        elif self.precision == 'int8_dynamic':  # Quantize weights of linear layers to int8, activations at runtime.
+            self.model = torch.quantization.quantize_dynamic(self.model, {torch.nn.Linear}, dtype=torch.qint8)
+        clogger.info('your inferer loaded, path: {}, precision: {}'.format(self._path, self.precision))
         return True
 
     def infer(self, inp, context: GrpsContext):
@@ -75,11 +113,38 @@ class YourInferer(ModelInferer):
         """
         input_ids = inp['input_ids'].to(self._device)
         outputs = self.model(input_ids)
-        sample = outputs[0][0].detach().cpu().numpy()
+        sample = outputs[0][0].detach().float().cpu().numpy()  # Numpy does not support bf16.
 
         pred = np.argmax(sample, axis=1)
         return {'pred': pred}
 
+    def batch_infer(self, inp, contexts: list):
+        """
+        Batch infer. Each sequence length bucket built by converter batch_preprocess runs its own forward.
+
+        Args:
+            inp: Model infer input, which is output of converter batch_preprocess function. When in `no converter mode`,
+            will skip converter batch_preprocess and directly use GrpsMessage list as input.
+            contexts: Grps context list.
+
+        Returns:
+            Model infer output, which will be input of converter batch_postprocess function. When in `no converter
+            mode`, it will skip converter batch_postprocess and should directly use GrpsMessage list as output.
+
+        Raises:
+            Exception: If batch infer failed, can raise exception and exception will be caught by server and return
+            error message to client.
+        """
+        preds = {}
+        with torch.no_grad():
+            for bucket, tensors in inp.items():
+                input_ids = tensors['input_ids'].to(self._device)
+                attention_mask = tensors['attention_mask'].to(self._device)
+                outputs = self.model(input_ids, attention_mask=attention_mask)
+                samples = outputs[0].detach().float().cpu().numpy()
+                preds[bucket] = np.argmax(samples, axis=2)
+        return {'pred': preds}
+
 
 # Register
 inferer_register.register('your_inferer', YourInferer())
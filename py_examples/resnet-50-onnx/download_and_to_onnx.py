@@ -0,0 +1,128 @@
+# Copyright 2022 netease. All rights reserved.
+# Author zhaochaochao@corp.netease.com
+# Date   2024/7/1
+# Brief  Convert torch resnet50 model to onnx model, and compare cpu speed of onnxruntime and torch.
+
+import os
+import timeit
+import urllib.request
+
+import cv2
+import numpy as np
+import onnxruntime as ort
+import torch
+import torchvision
+
+MODEL_PATH = './data/'
+ONNX_MODEL_PATH = MODEL_PATH + 'resnet50.onnx'
+BENCHMARK_BATCH_SIZES = [1, 4, 16]
+
+SYNSET_URL = "".join(
+    [
+        "https://gist.githubusercontent.com/zhreshold/",
+        "4d0b62f3d01426887599d4f7ede23ee5/raw/",
+        "596b27d23537e5a1b5751d2b0481ef172f58b539/",
+        "imagenet1000_clsid_to_human.txt",
+    ]
+)
+SYNSET_NAME = MODEL_PATH + "imagenet1000_clsid_to_human.txt"
+
+
+def load_data():
+    print('Loading image data...')
+    img = cv2.imread('./data/tabby.jpeg')
+    img = cv2.resize(img, (224, 224))
+    img = np.array(img)[np.newaxis, :].astype("float32")
+    img = img[:, :, :, ::-1]  # BGR -> RGB
+    image = np.float32(img) / 255.0
+    image[:, :, ] -= (np.float32(0.485), np.float32(0.456), np.float32(0.406))
+    image[:, :, ] /= (np.float32(0.229), np.float32(0.224), np.float32(0.225))
+    return np.ascontiguousarray(image.transpose((0, 3, 1, 2)))
+
+
+def load_torch_model():
+    print('Loading pytorch model...')
+    model = torchvision.models.resnet50(pretrained=True).eval()
+    print('Loaded pytorch resnet-50 model.')
+    return model
+
+
+def torch_2_onnx(torch_model):
+    """export onnx model with dynamic batch dimension, same input and output names as resnet-50-trt."""
+    print('Transfer torch model to onnx model...')
+    dummy_input = torch.randn(1, 3, 224, 224)
+    if not os.path.exists(MODEL_PATH):
+        os.makedirs(MODEL_PATH)
+    torch.onnx.export(torch_model, dummy_input, ONNX_MODEL_PATH,
+                      input_names=['x'],
+                      output_names=['495'],
+                      dynamic_axes={'x': [0], '495': [0]},
+                      opset_version=11)
+
+
+def load_ort_session():
+    print('Loading onnxruntime session...')
+    sess_options = ort.SessionOptions()
+    sess_options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+    return ort.InferenceSession(ONNX_MODEL_PATH, sess_options, providers=['CPUExecutionProvider'])
+
+
+def confirm_output(data, torch_model, ort_session):
+    """confirm the output of torch and onnxruntime model."""
+    urllib.request.urlretrieve(SYNSET_URL, SYNSET_NAME)
+    with open(SYNSET_NAME) as f:
+        synset = eval(f.read())
+
+    with torch.no_grad():
+        torch_output = torch_model(torch.from_numpy(data)).numpy()
+    torch_top5 = np.argsort(torch_output[0])[-1:-6:-1]
+    print("Torch output top-5 id: {}, predict class name: {}".format(torch_top5, synset[torch_top5[0]]))
+
+    ort_output = ort_session.run(['495'], {'x': data})[0]
+    ort_top5 = np.argsort(ort_output[0])[-1:-6:-1]
+    print("Onnxruntime output top-5 id: {}, predict class name: {}, max abs diff: {:.6f}".format(
+        ort_top5, synset[ort_top5[0]], np.abs(ort_output - torch_output).max()))
+
+
+def compare_infer_speed(data, torch_model, ort_session):
+    """compare the cpu infer speed of torch and onnxruntime model with different batch sizes."""
+    timing_number = 10
+    timing_repeat = 5
+    for batch_size in BENCHMARK_BATCH_SIZES:
+        batch = np.ascontiguousarray(np.repeat(data, batch_size, axis=0))
+        input_x = torch.from_numpy(batch)
+        with torch.no_grad():
+            torch_speed = (
+                    np.array(timeit.Timer(lambda: torch_model(input_x))
+                             .repeat(repeat=timing_repeat, number=timing_number))
+                    * 1000 / timing_number
+            )
+        ort_speed = (
+                np.array(timeit.Timer(lambda: ort_session.run(['495'], {'x': batch}))
+                         .repeat(repeat=timing_repeat, number=timing_number))
+                * 1000 / timing_number
+        )
+        torch_latency = np.median(torch_speed)
+        ort_latency = np.median(ort_speed)
+        print('batch_size: {}, torch: {:.2f} ms, {:.2f} img/s, onnxruntime: {:.2f} ms, {:.2f} img/s'
+              .format(batch_size, torch_latency, batch_size * 1000 / torch_latency, ort_latency,
+                      batch_size * 1000 / ort_latency))
+
+
+if __name__ == '__main__':
+    data = load_data()  # load image data
+
+    # load torch resnet-50 model
+    torch_model = load_torch_model()
+
+    # convert to onnx.
+    torch_2_onnx(torch_model)
+
+    # load onnxruntime session
+    ort_session = load_ort_session()
+
+    # confirm the output of torch and onnxruntime
+    confirm_output(data, torch_model, ort_session)
+
+    # compare the cpu infer speed of torch and onnxruntime model
+    compare_infer_speed(data, torch_model, ort_session)
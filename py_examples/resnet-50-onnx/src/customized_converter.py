@@ -0,0 +1,245 @@
+# Copyright 2022 netease. All rights reserved.
+# Author zhaochaochao@corp.netease.com
+# Date   2023/9/5
+# Brief  Customized converter of model, including pre-process and post-process.
+import os
+import time
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+
+import cv2
+import numpy as np
+from grps_framework.apis.grps_pb2 import GrpsMessage
+from grps_framework.conf.conf import global_conf
+from grps_framework.context.context import GrpsContext
+from grps_framework.converter.converter import Converter, converter_register
+from grps_framework.logger.logger import clogger
+from grps_framework.monitor.monitor import app_monitor
+
+
+class YourConverter(Converter):
+    """Your converter."""
+
+    def __init__(self):
+        super().__init__()
+        self.__synset = None
+        self.__metrics_prefix = None
+        self.__max_batch_size = None
+        self.__batch_tp = ThreadPoolExecutor(max_workers=os.cpu_count())
+
+    def init(self, path=None, args=None):
+        """
+        Init converter.
+
+        Args:
+            path: Path.
+            args: More args.
+
+        Raises:
+            Exception: If init failed, can raise exception and exception will be caught by server and show error message
+            to user when start service.
+        """
+        super().init(path, args)
+        clogger.info('your converter init, path: {}, args: {}'.format(path, args))
+        with open(path) as f:
+            self.__synset = eval(f.read())
+
+        # Model(name-version format) bound with this converter, used as prefix of batching metrics.
+        self.__metrics_prefix = args.get('model') if args else None
+        if self.__metrics_prefix:
+            for model_desc in global_conf.inference_conf['models']:
+                if '{}-{}'.format(model_desc.get('name'), model_desc.get('version')) == self.__metrics_prefix:
+                    self.__max_batch_size = (model_desc.get('batching') or {}).get('max_batch_size')
+                    break
+            else:
+                raise ValueError('Invalid model: {}, should be name-version of model declared in inference.yml.'
+                                 .format(self.__metrics_prefix))
+
+        # Decoding workers default to cpus this process can run on(e.g. limited by taskset or cpuset), instead of all
+        # cpus of the host, to avoid oversubscribing cpu together with model inferer threads.
+        preprocess_workers = args.get('preprocess_workers') if args else None
+        if preprocess_workers is None:
+            preprocess_workers = len(os.sched_getaffinity(0))
+        elif type(preprocess_workers) is not int or preprocess_workers <= 0:
+            raise ValueError('Invalid preprocess_workers: {}, should be positive int.'.format(preprocess_workers))
+
+        self.__batch_tp.shutdown()
+        self.__batch_tp = ThreadPoolExecutor(max_workers=preprocess_workers)
+        clogger.info('your converter preprocess workers: {}, cpu affinity: {}'.format(
+            preprocess_workers, sorted(os.sched_getaffinity(0))))
+
+    def __monitor_batch_preprocess(self, batch_size, deduped, begin, contexts):
+        """
+        Monitor batch size, batch fill ratio, deduplicated count and preprocess latency, will be shown in
+        /grps/v1/monitor/metrics.
+        """
+        if not self.__metrics_prefix:
+            return
+        end = time.time()
+        app_monitor.avg(self.__metrics_prefix + '_batch_size_avg', batch_size)
+        app_monitor.cdf(self.__metrics_prefix + '_batch_size_cdf', batch_size)
+        if self.__max_batch_size:
+            app_monitor.avg(self.__metrics_prefix + '_batch_fill_ratio(%)', batch_size * 100 / self.__max_batch_size)
+        if deduped:
+            app_monitor.inc(self.__metrics_prefix + '_batch_dedup', deduped)
+        app_monitor.avg(self.__metrics_prefix + '_preprocess_latency_avg(ms)', (end - begin) * 1e3)
+        for context in contexts:
+            context.put_user_data('preprocess_end', end)
+
+    def __monitor_batch_postprocess(self, begin, contexts):
+        """Monitor model infer and postprocess latency, will be shown in /grps/v1/monitor/metrics."""
+        if not self.__metrics_prefix:
+            return
+        app_monitor.avg(self.__metrics_prefix + '_infer_latency_avg(ms)',
+                        (begin - contexts[0].get_user_data('preprocess_end')) * 1e3)
+        app_monitor.avg(self.__metrics_prefix + '_postprocess_latency_avg(ms)', (time.time() - begin) * 1e3)
+
+    def preprocess(self, inp: GrpsMessage, context: GrpsContext):
+        """
+        Preprocess.
+
+        Args:
+            inp: Input message from client or previous model(multi model sequential mode).
+            context: Grps context of current request.
+
+        Returns:
+            Pre-processed data which is input of model inferer.
+
+        Raises:
+            Exception: If preprocess failed, can raise exception and exception will be caught by server and return error
+            message to client.
+        """
+        img_data = inp.bin_data
+        img = cv2.imdecode(np.frombuffer(img_data, np.uint8), cv2.IMREAD_COLOR)
+        img = cv2.resize(img, (224, 224))
+        img = np.array(img)[np.newaxis, :].astype("float32")
+        img = img[:, :, :, ::-1]  # BGR -> RGB
+        img = np.float32(img) / 255.0
+        img[:, :, ] -= (np.float32(0.485), np.float32(0.456), np.float32(0.406))
+        img[:, :, ] /= (np.float32(0.229), np.float32(0.224), np.float32(0.225))
+        img = img.transpose((0, 3, 1, 2))
+        return img
+
+    def postprocess(self, inp, context: GrpsContext) -> GrpsMessage:
+        """
+        Postprocess.
+
+        Args:
+            inp: Input to be post-processed, which is output of model inferer.
+            context: Grps context of current request.
+
+        Returns:
+            Post-processed data with GrpsMessage format to client or next model(multi model sequential mode).
+
+        Raises:
+            Exception: If postprocess failed, can raise exception and exception will be caught by server and return
+            error message to client.
+        """
+        inp = inp['495']  # out tensor name.
+        label = np.argmax(inp[0])
+        out = GrpsMessage(str_data=self.__synset[label].replace('\n', ''))
+        return out
+
+    def batch_preprocess(self, inps: list, contexts: list):
+        """
+        Batch preprocess.
+
+        Args:
+            inps: Input messages from client or previous model(multi model sequential mode).
+            contexts: Grps contexts of current requests.
+
+        Returns:
+            Pre-processed data which is input of model inferer.
+
+        Raises:
+            Exception: If preprocess failed, can raise exception and exception will be caught by server and return error
+            message to client.
+        """
+        begin = time.time()
+        imgs_future = {}  # Image data -> (contexts, decode future).
+
+        def decode_fn(img_data):
+            img = cv2.imdecode(np.frombuffer(img_data, np.uint8), cv2.IMREAD_COLOR)
+            if img is None:
+                raise ValueError('Invalid image data, decode failed.')
+            return cv2.resize(img, (224, 224))
+
+        for inp, context in zip(inps, contexts):
+            # Client has cancelled or grpc deadline has been exceeded, skip it to avoid wasting decode and infer.
+            if context.if_disconnected():
+                clogger.warning('your converter batch_preprocess, drop request whose client has disconnected.')
+                context.set_err_msg('Client disconnected or deadline exceeded before preprocess.')
+                continue
+            img_data = inp.bin_data
+            if img_data in imgs_future:  # Identical image in the same batch, decode and infer only once.
+                imgs_future[img_data][0].append(context)
+                continue
+            imgs_future[img_data] = ([context], self.__batch_tp.submit(decode_fn, img_data))
+
+        # Only fail the requests whose image is bad, other requests in the batch continue.
+        imgs = []
+        for img_contexts, future in imgs_future.values():
+            try:
+                img = future.result()
+            except Exception:
+                err_msg = traceback.format_exc()
+                clogger.error('your converter batch_preprocess, decode image failed: {}'.format(err_msg))
+                for context in img_contexts:
+                    context.set_err_msg('Decode image failed: {}'.format(err_msg))
+                continue
+            for context in img_contexts:  # Identical images share one row of the batch.
+                context.put_user_data('batch_idx', len(imgs))
+            imgs.append(img)
+
+        if not imgs:  # All requests have been dropped or failed.
+            return None
+
+        # Stack uint8 images and normalize the whole batch at once, instead of normalizing and copying float images
+        # one by one.
+        imgs = np.array(imgs)
+        imgs = imgs[:, :, :, ::-1]  # BGR -> RGB
+        imgs = np.float32(imgs) / 255.0
+        imgs[:, :, :, ] -= (np.float32(0.485), np.float32(0.456), np.float32(0.406))
+        imgs[:, :, :, ] /= (np.float32(0.229), np.float32(0.224), np.float32(0.225))
+        imgs = np.ascontiguousarray(imgs.transpose((0, 3, 1, 2)))
+        deduped = sum(len(img_contexts) - 1 for img_contexts, _ in imgs_future.values())
+        self.__monitor_batch_preprocess(len(inps), deduped, begin, contexts)
+        return imgs
+
+    def batch_postprocess(self, inp, contexts: list) -> list:
+        """
+        Batch postprocess.
+
+        Args:
+            inp: Input to be post-processed, which is output of model inferer.
+            contexts: Grps contexts of current requests.
+
+        Returns:
+            Post-processed data with GrpsMessage format to client or next model(multi model sequential mode).
+
+        Raises:
+            Exception: If postprocess failed, can raise exception and exception will be caught by server and return
+            error message to client.
+        """
+        begin = time.time()
+        inp = inp['495']  # out tensor name.
+        labels = np.argmax(inp, axis=1)
+        outs = []
+        for context in contexts:
+            if context.has_err():  # Dropped or failed in batch_preprocess.
+                outs.append(None)
+                continue
+            try:
+                label = labels[context.get_user_data('batch_idx')]
+                out = GrpsMessage(str_data=self.__synset[label].replace('\n', ''))
+            except Exception:  # Only fail this request, other requests in the batch continue.
+                err_msg = traceback.format_exc()
+                clogger.error('your converter batch_postprocess failed: {}'.format(err_msg))
+                context.set_err_msg('Postprocess failed: {}'.format(err_msg))
+                out = None
+            outs.append(out)
+        self.__monitor_batch_postprocess(begin, contexts)
+        return outs
+
+
+converter_register.register('your_converter', YourConverter())
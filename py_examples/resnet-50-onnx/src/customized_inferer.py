@@ -0,0 +1,184 @@
+# Copyright 2022 netease. All rights reserved.
+# Author zhaochaochao@corp.netease.com
+# Date   2024/7/1
+# Brief  Customized onnxruntime model inferer. Including model load and model infer.
+import hashlib
+import os
+import re
+
+import onnxruntime as ort
+from grps_framework.context.context import GrpsContext
+from grps_framework.logger.logger import clogger
+from grps_framework.model_infer.inferer import ModelInferer, inferer_register
+
+
+class YourInferer(ModelInferer):
+    """Onnx model inferer based on onnxruntime."""
+
+    GRAPH_OPTIMIZATION_LEVELS = {
+        'disable': ort.GraphOptimizationLevel.ORT_DISABLE_ALL,
+        'basic': ort.GraphOptimizationLevel.ORT_ENABLE_BASIC,
+        'extended': ort.GraphOptimizationLevel.ORT_ENABLE_EXTENDED,
+        'all': ort.GraphOptimizationLevel.ORT_ENABLE_ALL,
+    }
+
+    def __init__(self):
+        super().__init__()
+        self.__session = None
+        self.__sess_options = None
+        self.__providers = None
+        self.__device = 'cpu'
+        self.__level = 'all'
+        self.__optimized_model_dir = None
+        self.__inp_name = None
+        self.__out_names = None
+
+    def init(self, path, device=None, args=None):
+        """
+        Initiate model inferer class with model path and device.
+
+        Args:
+            path: Model path, it can be a file path or a directory path.
+            device: Device to run model.
+            args: More args.
+
+        Raises:
+            Exception: If init failed, can raise exception. Will be caught by server and show error message to user when
+            start service.
+        """
+        super(YourInferer, self).init(path, device, args)
+        args = args or {}
+        if not device or device == 'cpu':
+            self.__providers = ['CPUExecutionProvider']
+        elif device in ['cuda', 'gpu'] or re.match('^(cuda|gpu):\\d+$', device):
+            device_id = int(device.split(':')[1]) if ':' in device else 0
+            self.__device = 'cuda:{}'.format(device_id)
+            self.__providers = [('CUDAExecutionProvider', {'device_id': device_id}), 'CPUExecutionProvider']
+        else:
+            raise ValueError('Invalid device: {}, should be cpu, cuda, gpu, cuda:[num] or gpu:[num].'.format(device))
+
+        self.__sess_options = ort.SessionOptions()
+        level = args.get('graph_optimization_level', 'all')
+        if level not in self.GRAPH_OPTIMIZATION_LEVELS:
+            raise ValueError('Invalid graph_optimization_level: {}, should be disable, basic, extended or all.'
+                             .format(level))
+        self.__level = level
+        self.__sess_options.graph_optimization_level = self.GRAPH_OPTIMIZATION_LEVELS[level]
+        for name in ['intra_op_threads', 'inter_op_threads']:
+            threads = args.get(name)
+            if threads is not None and (type(threads) is not int or threads <= 0):
+                raise ValueError('Invalid {}: {}, should be positive int.'.format(name, threads))
+        if args.get('intra_op_threads'):
+            self.__sess_options.intra_op_num_threads = args['intra_op_threads']
+        if args.get('inter_op_threads'):
+            self.__sess_options.inter_op_num_threads = args['inter_op_threads']
+        execution_mode = args.get('execution_mode', 'sequential')
+        if execution_mode == 'parallel':
+            self.__sess_options.execution_mode = ort.ExecutionMode.ORT_PARALLEL
+        elif execution_mode != 'sequential':
+            raise ValueError('Invalid execution_mode: {}, should be sequential or parallel.'.format(execution_mode))
+        self.__optimized_model_dir = args.get('optimized_model_dir')
+        clogger.info('your infer init, path: {}, device: {}, args: {}, providers: {}.'.format(
+            path, device, args, self.__providers))
+
+    def __saved_level(self):
+        """
+        Graph optimization level of saved model. `all` level includes layout optimizations specific to hardware of
+        current host, so only optimizations up to `extended` are saved and the rest are applied when loading.
+        """
+        return 'extended' if self.__level == 'all' else self.__level
+
+    def __cache_path(self):
+        """
+        Path of saved optimized model, keyed by md5 of model file, onnxruntime version, device and graph optimization
+        level.
+        """
+        md5 = hashlib.md5()
+        with open(self._path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1 << 20), b''):
+                md5.update(chunk)
+        name = '{}_ort{}_{}_{}.onnx'.format(md5.hexdigest(), ort.__version__, self.__device.replace(':', ''),
+                                            self.__saved_level())
+        return os.path.join(self.__optimized_model_dir, name)
+
+    def __save_cache(self, cache_path):
+        """Optimize model and save to cache, failure only loses cache, so only warns instead of failing load."""
+        tmp_path = '{}.{}.tmp'.format(cache_path, os.getpid())
+        try:
+            os.makedirs(self.__optimized_model_dir, exist_ok=True)
+            sess_options = ort.SessionOptions()
+            sess_options.graph_optimization_level = self.GRAPH_OPTIMIZATION_LEVELS[self.__saved_level()]
+            sess_options.optimized_model_filepath = tmp_path
+            ort.InferenceSession(self._path, sess_options, providers=self.__providers)
+            os.replace(tmp_path, cache_path)  # Atomic, other process will not load half written model.
+        except Exception as e:
+            clogger.warning('your inferer save optimized model to cache: {} failed: {}'.format(cache_path, e))
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            return False
+        return True
+
+    def load(self):
+        """
+        Load model from model path.
+
+        Returns:
+            True if load model successfully, otherwise False.
+
+        Raises:
+            Exception: If load failed, can raise exception and exception will be caught by server and show error message
+            to user when start service.
+        """
+        path = self._path
+        if self.__optimized_model_dir and self.__level != 'disable':
+            cache_path = self.__cache_path()
+            if os.path.exists(cache_path) or self.__save_cache(cache_path):
+                # Saved optimizations are skipped, only hardware specific ones of `all` level still run.
+                path = cache_path
+                self.__sess_options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL \
+                    if self.__level == 'all' else ort.GraphOptimizationLevel.ORT_DISABLE_ALL
+        self.__session = ort.InferenceSession(path, self.__sess_options, providers=self.__providers)
+        self.__inp_name = self.__session.get_inputs()[0].name
+        self.__out_names = [out.name for out in self.__session.get_outputs()]
+        clogger.info('your inferer loaded, path: {}, input: {}, outputs: {}, providers: {}'.format(
+            path, self.__inp_name, self.__out_names, self.__session.get_providers()))
+        return True
+
+    def infer(self, inp, context: GrpsContext):
+        """
+        The inference function is used to make a prediction call on the given input request.
+
+        Args:
+            context: grps context
+            inp: Model infer input, which is output of converter preprocess function.
+
+        Returns:
+            Model infer output, which will be input of converter postprocess function. Dict with output name as key.
+
+        Raises:
+            Exception: If infer failed, can raise exception and exception will be caught by server and return error
+            message to client.
+        """
+        outs = self.__session.run(self.__out_names, {self.__inp_name: inp})
+        return dict(zip(self.__out_names, outs))
+
+    def batch_infer(self, inp, contexts: list):
+        """
+        Batch infer. Batch dimension of onnx model is dynamic, so the whole batch runs in one session run.
+
+        Args:
+            inp: Model infer input, which is output of converter batch_preprocess function.
+            contexts: Grps context list.
+
+        Returns:
+            Model infer output, which will be input of converter batch_postprocess function.
+
+        Raises:
+            Exception: If batch infer failed, can raise exception and exception will be caught by server and return
+            error message to client.
+        """
+        return self.infer(inp, contexts[0])
+
+
+# Register
+inferer_register.register('your_inferer', YourInferer())
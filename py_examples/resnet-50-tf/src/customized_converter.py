@@ -3,15 +3,18 @@
 # Date   2023/9/5
 # Brief  Customized converter of model, including pre-process and post-process.
 import os
+import time
+import traceback
+from concurrent.futures import ThreadPoolExecutor
 
 import cv2
 import numpy as np
-import tensorflow as tf
 from grps_framework.apis.grps_pb2 import GrpsMessage
+from grps_framework.conf.conf import global_conf
 from grps_framework.context.context import GrpsContext
 from grps_framework.converter.converter import Converter, converter_register
 from grps_framework.logger.logger import clogger
-from concurrent.futures import ThreadPoolExecutor
+from grps_framework.monitor.monitor import app_monitor
 
 
 class YourConverter(Converter):
@@ -20,6 +23,8 @@ class YourConverter(Converter):
     def __init__(self):
         super().__init__()
         self.__synset = None
+        self.__metrics_prefix = None
+        self.__max_batch_size = None
         self.__batch_tp = ThreadPoolExecutor(max_workers=os.cpu_count())
 
     def init(self, path=None, args=None):
@@ -39,6 +44,56 @@ class YourConverter(Converter):
         with open(path) as f:
             self.__synset = f.readlines()
 
+        # Model(name-version format) bound with this converter, used as prefix of batching metrics.
+        self.__metrics_prefix = args.get('model') if args else None
+        if self.__metrics_prefix:
+            for model_desc in global_conf.inference_conf['models']:
+                if '{}-{}'.format(model_desc.get('name'), model_desc.get('version')) == self.__metrics_prefix:
+                    self.__max_batch_size = (model_desc.get('batching') or {}).get('max_batch_size')
+                    break
+            else:
+                raise ValueError('Invalid model: {}, should be name-version of model declared in inference.yml.'
+                                 .format(self.__metrics_prefix))
+
+        # Decoding workers default to cpus this process can run on(e.g. limited by taskset or cpuset), instead of all
+        # cpus of the host, to avoid oversubscribing cpu together with model inferer threads.
+        preprocess_workers = args.get('preprocess_workers') if args else None
+        if preprocess_workers is None:
+            preprocess_workers = len(os.sched_getaffinity(0))
+        elif type(preprocess_workers) is not int or preprocess_workers <= 0:
+            raise ValueError('Invalid preprocess_workers: {}, should be positive int.'.format(preprocess_workers))
+
+        self.__batch_tp.shutdown()
+        self.__batch_tp = ThreadPoolExecutor(max_workers=preprocess_workers)
+        clogger.info('your converter preprocess workers: {}, cpu affinity: {}'.format(
+            preprocess_workers, sorted(os.sched_getaffinity(0))))
+
+    def __monitor_batch_preprocess(self, batch_size, deduped, begin, contexts):
+        """
+        Monitor batch size, batch fill ratio, deduplicated count and preprocess latency, will be shown in
+        /grps/v1/monitor/metrics.
+        """
+        if not self.__metrics_prefix:
+            return
+        end = time.time()
+        app_monitor.avg(self.__metrics_prefix + '_batch_size_avg', batch_size)
+        app_monitor.cdf(self.__metrics_prefix + '_batch_size_cdf', batch_size)
+        if self.__max_batch_size:
+            app_monitor.avg(self.__metrics_prefix + '_batch_fill_ratio(%)', batch_size * 100 / self.__max_batch_size)
+        if deduped:
+            app_monitor.inc(self.__metrics_prefix + '_batch_dedup', deduped)
+        app_monitor.avg(self.__metrics_prefix + '_preprocess_latency_avg(ms)', (end - begin) * 1e3)
+        for context in contexts:
+            context.put_user_data('preprocess_end', end)
+
+    def __monitor_batch_postprocess(self, begin, contexts):
+        """Monitor model infer and postprocess latency, will be shown in /grps/v1/monitor/metrics."""
+        if not self.__metrics_prefix:
+            return
+        app_monitor.avg(self.__metrics_prefix + '_infer_latency_avg(ms)',
+                        (begin - contexts[0].get_user_data('preprocess_end')) * 1e3)
+        app_monitor.avg(self.__metrics_prefix + '_postprocess_latency_avg(ms)', (time.time() - begin) * 1e3)
+
     def preprocess(self, inp: GrpsMessage, context: GrpsContext):
         """
         Preprocess.
@@ -75,8 +130,8 @@ class YourConverter(Converter):
             Post-processed data with GrpsMessage format to client or next model(multi model sequential mode).
 
         Raises:
-            Exception: If postprocess failed, can raise exception and exception will be caught by server and return error
-            message to client.
+            Exception: If postprocess failed, can raise exception and exception will be caught by server and return
+            error message to client.
         """
         label = np.argmax(inp.numpy()[0])
         out = GrpsMessage(str_data=self.__synset[label].replace('\n', ''))
@@ -97,22 +152,54 @@ class YourConverter(Converter):
             Exception: If preprocess failed, can raise exception and exception will be caught by server and return error
             message to client.
         """
-        imgs_future = []
+        begin = time.time()
+        imgs_future = {}  # Image data -> (contexts, decode future).
 
         def decode_fn(img_data):
             img = cv2.imdecode(np.frombuffer(img_data, np.uint8), cv2.IMREAD_COLOR)
-            img = cv2.resize(img, (224, 224))
-            img = img.astype(np.float32)
-            img = img / 255.0
-            img = img[:, :, ::-1]
-            return img
-
-        for inp in inps:
+            if img is None:
+                raise ValueError('Invalid image data, decode failed.')
+            return cv2.resize(img, (224, 224))
+
+        for inp, context in zip(inps, contexts):
+            # Client has cancelled or grpc deadline has been exceeded, skip it to avoid wasting decode and infer.
+            if context.if_disconnected():
+                clogger.warning('your converter batch_preprocess, drop request whose client has disconnected.')
+                context.set_err_msg('Client disconnected or deadline exceeded before preprocess.')
+                continue
             img_data = inp.bin_data
-            imgs_future.append(self.__batch_tp.submit(decode_fn, img_data))
-
-        imgs = [future.result() for future in imgs_future]
-        return np.array(imgs)
+            if img_data in imgs_future:  # Identical image in the same batch, decode and infer only once.
+                imgs_future[img_data][0].append(context)
+                continue
+            imgs_future[img_data] = ([context], self.__batch_tp.submit(decode_fn, img_data))
+
+        # Only fail the requests whose image is bad, other requests in the batch continue.
+        imgs = []
+        for img_contexts, future in imgs_future.values():
+            try:
+                img = future.result()
+            except Exception:
+                err_msg = traceback.format_exc()
+                clogger.error('your converter batch_preprocess, decode image failed: {}'.format(err_msg))
+                for context in img_contexts:
+                    context.set_err_msg('Decode image failed: {}'.format(err_msg))
+                continue
+            for context in img_contexts:  # Identical images share one row of the batch.
+                context.put_user_data('batch_idx', len(imgs))
+            imgs.append(img)
+
+        if not imgs:  # All requests have been dropped or failed, model inferer will not run.
+            return None
+
+        # Stack uint8 images and convert the whole batch at once, instead of converting and copying float images one
+        # by one.
+        imgs = np.array(imgs)
+        imgs = imgs.astype(np.float32) / 255.0
+        imgs = imgs[:, :, :, ::-1]  # BGR -> RGB
+        imgs = np.ascontiguousarray(imgs)
+        deduped = sum(len(img_contexts) - 1 for img_contexts, _ in imgs_future.values())
+        self.__monitor_batch_preprocess(len(inps), deduped, begin, contexts)
+        return imgs
 
     def batch_postprocess(self, inp, contexts: list) -> list:
         """
@@ -129,11 +216,23 @@ class YourConverter(Converter):
             Exception: If postprocess failed, can raise exception and exception will be caught by server and return
             error message to client.
         """
+        begin = time.time()
         labels = np.argmax(inp.numpy(), axis=1)
         outs = []
-        for label in labels:
-            out = GrpsMessage(str_data=self.__synset[label].replace('\n', ''))
+        for context in contexts:
+            if context.has_err():  # Dropped or failed in batch_preprocess.
+                outs.append(None)
+                continue
+            try:
+                label = labels[context.get_user_data('batch_idx')]
+                out = GrpsMessage(str_data=self.__synset[label].replace('\n', ''))
+            except Exception:  # Only fail this request, other requests in the batch continue.
+                err_msg = traceback.format_exc()
+                clogger.error('your converter batch_postprocess failed: {}'.format(err_msg))
+                context.set_err_msg('Postprocess failed: {}'.format(err_msg))
+                out = None
             outs.append(out)
+        self.__monitor_batch_postprocess(begin, contexts)
         return outs
 
 
@@ -3,6 +3,7 @@
 # Date   2023/9/5
 # Brief  Local unittest.
 import unittest
+from concurrent.futures import ThreadPoolExecutor
 
 from grps_framework.context.context import GrpsContext
 from grps_framework.test import GrpsTest
@@ -26,9 +27,33 @@ class MyTestCase(GrpsTest):
         # Check result.
         self.assertEqual(grps_out.str_data, 'tabby')
 
+    def test_concurrent_infer_with_bad_image(self):
+        self.test_init()
+
+        with open('./data/tabby.jpeg', 'rb') as f:
+            img_data = f.read()
+
+        # Concurrent requests will be batched together, only the request with bad image should fail.
+        def infer_fn(i):
+            grps_in = GrpsMessage(bin_data=b'not an image' if i == 0 else img_data)
+            context = GrpsContext()
+            grps_out = self.executor.infer(grps_in, context)
+            return context, grps_out
+
+        with ThreadPoolExecutor(max_workers=8) as tp:
+            results = list(tp.map(infer_fn, range(8)))
+
+        for i, (context, grps_out) in enumerate(results):
+            if i == 0:
+                self.assertEqual(context.has_err(), True)
+            else:
+                self.assertEqual(context.has_err(), False)
+                self.assertEqual(grps_out.str_data, 'tabby')
+
 
 if __name__ == '__main__':
     suite = unittest.TestSuite()
     suite.addTest(MyTestCase('test_infer'))
+    suite.addTest(MyTestCase('test_concurrent_infer_with_bad_image'))
     runner = unittest.TextTestRunner()
     runner.run(suite)
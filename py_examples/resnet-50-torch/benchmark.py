@@ -0,0 +1,88 @@
+# Copyright 2022 netease. All rights reserved.
+# Author zhaochaochao@corp.netease.com
+# Date   2024/7/1
+# Brief  Benchmark cpu accuracy and throughput of torch script resnet50 model in different modes against fp32.
+
+import timeit
+
+import cv2
+import numpy as np
+import torch
+
+MODEL_PATH = './data/resnet50_pretrained.pt'
+IMG_PATH = './data/tabby.jpeg'
+BENCHMARK_BATCH_SIZES = [1, 4, 16]
+# (name, precision, memory format, optimize), same as `precision`, `memory_format` and `optimize` of inferer_args.
+BENCHMARK_MODES = [
+    ('fp32', torch.float32, torch.contiguous_format, False),
+    ('fp32_optimized', torch.float32, torch.contiguous_format, True),
+    ('fp32_channels_last', torch.float32, torch.channels_last, False),
+    ('bf16', torch.bfloat16, torch.contiguous_format, False),
+    ('bf16_channels_last_optimized', torch.bfloat16, torch.channels_last, True),
+]
+
+
+def load_data():
+    """load image data with the same preprocess as src/customized_converter.py."""
+    img = cv2.imread(IMG_PATH)
+    img = torch.from_numpy(img).float().div(255)
+    img = img.permute(2, 0, 1).unsqueeze(0)
+    img = torch.nn.functional.interpolate(img, size=(224, 224), mode='bilinear')
+    mean = torch.tensor([0.485, 0.456, 0.406]).view(1, 3, 1, 1)
+    std = torch.tensor([0.229, 0.224, 0.225]).view(1, 3, 1, 1)
+    return img.sub(mean).div(std)
+
+
+def load_model(dtype, memory_format, optimize):
+    """load model in given mode, same as src/customized_inferer.py."""
+    model = torch.jit.load(MODEL_PATH, map_location='cpu').eval()
+    model.to(dtype)
+    model.to(memory_format=memory_format)
+    if optimize:
+        model = torch.jit.freeze(model)
+        if hasattr(torch.jit, 'optimize_for_inference'):  # Since torch 1.10.
+            model = torch.jit.optimize_for_inference(model)
+    return model
+
+
+def infer(model, data, dtype, memory_format):
+    with torch.no_grad():
+        return model(data.to(dtype, memory_format=memory_format)).float()
+
+
+def benchmark(model, dtype, memory_format, batch_size):
+    """benchmark latency of model with given batch size, returns median latency in ms."""
+    timing_number = 10
+    timing_repeat = 5
+    data = torch.randn(batch_size, 3, 224, 224)
+    for _ in range(3):  # warmup, torch script profiles and optimizes graph in first runs.
+        infer(model, data, dtype, memory_format)
+    speed = (
+            np.array(timeit.Timer(lambda: infer(model, data, dtype, memory_format))
+                     .repeat(repeat=timing_repeat, number=timing_number))
+            * 1000 / timing_number
+    )
+    return np.median(speed)
+
+
+if __name__ == '__main__':
+    print('torch version: {}, threads: {}'.format(torch.__version__, torch.get_num_threads()))
+    data = load_data()
+    fp32_out = None
+    for name, dtype, memory_format, optimize in BENCHMARK_MODES:
+        try:
+            model = load_model(dtype, memory_format, optimize)
+            out = infer(model, data, dtype, memory_format)
+        except RuntimeError as e:  # Mode may be not supported by current torch or cpu.
+            print('mode: {}, not supported: {}'.format(name, e))
+            continue
+        if fp32_out is None:
+            fp32_out = out
+
+        # confirm accuracy against fp32 model
+        print('mode: {}, top-1 id: {}, fp32 top-1 id: {}, max abs diff: {:.4f}'.format(
+            name, out.argmax(1).item(), fp32_out.argmax(1).item(), (out - fp32_out).abs().max().item()))
+        for batch_size in BENCHMARK_BATCH_SIZES:
+            latency = benchmark(model, dtype, memory_format, batch_size)
+            print('mode: {}, batch_size: {}, latency: {:.2f} ms, throughput: {:.2f} img/s'
+                  .format(name, batch_size, latency, batch_size * 1000 / latency))
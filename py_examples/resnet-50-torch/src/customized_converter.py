@@ -2,16 +2,93 @@
 # Author zhaochaochao@corp.netease.com
 # Date   2023/9/5
 # Brief  Customized converter of model, including pre-process and post-process.
+import hashlib
 import os
+import re
+import sys
+import threading
+import time
+import traceback
+from collections import OrderedDict
 from concurrent.futures import ThreadPoolExecutor
 
 import cv2
 import numpy as np
 import torch
 from grps_framework.apis.grps_pb2 import GrpsMessage
+from grps_framework.conf.conf import global_conf
 from grps_framework.context.context import GrpsContext
 from grps_framework.converter.converter import Converter, converter_register
 from grps_framework.logger.logger import clogger
+from grps_framework.monitor.monitor import app_monitor
+
+
+class ResultCache(object):
+    """Thread-safe LRU cache of postprocessed results, keyed by content hash of input and bounded by ttl and memory."""
+
+    def __init__(self, max_bytes, ttl_s):
+        self.__max_bytes = max_bytes
+        self.__ttl_s = ttl_s
+        self.__bytes = 0
+        self.__items = OrderedDict()  # key -> (result, expire time), least recently used first.
+        self.__lock = threading.Lock()
+
+    @staticmethod
+    def key(data):
+        """Content hash of input data."""
+        return hashlib.sha1(data).digest()
+
+    @staticmethod
+    def __size(key, result):
+        return sys.getsizeof(key) + sys.getsizeof(result)
+
+    def get(self, key):
+        """
+        Get cached result.
+
+        Args:
+            key: Content hash of input data.
+
+        Returns:
+            Cached result and count of evicted(expired) items. Result is None if missed.
+        """
+        with self.__lock:
+            item = self.__items.get(key)
+            if item is None:
+                return None, 0
+            if item[1] < time.time():  # Expired.
+                del self.__items[key]
+                self.__bytes -= self.__size(key, item[0])
+                return None, 1
+            self.__items.move_to_end(key)
+            return item[0], 0
+
+    def put(self, key, result):
+        """
+        Put result into cache, least recently used items will be evicted when exceeding max bytes.
+
+        Args:
+            key: Content hash of input data.
+            result: Postprocessed result.
+
+        Returns:
+            Count of evicted items.
+        """
+        size = self.__size(key, result)
+        if size > self.__max_bytes:
+            return 0
+        with self.__lock:
+            old = self.__items.pop(key, None)
+            if old is not None:
+                self.__bytes -= self.__size(key, old[0])
+            self.__items[key] = (result, time.time() + self.__ttl_s)
+            self.__bytes += size
+            evicted = 0
+            while self.__bytes > self.__max_bytes:
+                old_key, old = self.__items.popitem(last=False)
+                self.__bytes -= self.__size(old_key, old[0])
+                evicted += 1
+            return evicted
 
 
 class YourConverter(Converter):
@@ -20,6 +97,14 @@ class YourConverter(Converter):
     def __init__(self):
         super().__init__()
         self.__synset = None
+        self.__mean = None
+        self.__std = None
+        self.__device = 'cuda'
+        self.__dtype = torch.float32
+        self.__memory_format = torch.contiguous_format
+        self.__metrics_prefix = None
+        self.__max_batch_size = None
+        self.__result_cache = None
         self.__batch_tp = ThreadPoolExecutor(max_workers=os.cpu_count())
 
     def init(self, path=None, args=None):
@@ -39,6 +124,119 @@ class YourConverter(Converter):
         with open(path) as f:
             self.__synset = f.readlines()
 
+        # Model(name-version format) bound with this converter, used as prefix of batching metrics and to produce input
+        # matching model inferer.
+        self.__metrics_prefix = args.get('model') if args else None
+        if self.__metrics_prefix:
+            for model_desc in global_conf.inference_conf['models']:
+                if '{}-{}'.format(model_desc.get('name'), model_desc.get('version')) == self.__metrics_prefix:
+                    self.__max_batch_size = (model_desc.get('batching') or {}).get('max_batch_size')
+                    # Same device, precision and memory format as model inferer, so inferer will not copy input again.
+                    inferer_args = model_desc.get('inferer_args') or {}
+                    self.__device = self.__inp_device(model_desc)
+                    if inferer_args.get('precision') == 'bf16':
+                        self.__dtype = torch.bfloat16
+                    if inferer_args.get('memory_format') == 'channels_last':
+                        self.__memory_format = torch.channels_last
+                    break
+            else:
+                raise ValueError('Invalid model: {}, should be name-version of model declared in inference.yml.'
+                                 .format(self.__metrics_prefix))
+
+        # Result cache of repeated images, disabled when result_cache_max_bytes is 0.
+        cache_max_bytes = args.get('result_cache_max_bytes', 0) if args else 0
+        cache_ttl_s = args.get('result_cache_ttl_s', 600) if args else 600
+        if type(cache_max_bytes) is not int or cache_max_bytes < 0:
+            raise ValueError('Invalid result_cache_max_bytes: {}, should be non-negative int.'.format(cache_max_bytes))
+        if type(cache_ttl_s) not in (int, float) or cache_ttl_s <= 0:
+            raise ValueError('Invalid result_cache_ttl_s: {}, should be positive number.'.format(cache_ttl_s))
+        if cache_max_bytes > 0:
+            self.__result_cache = ResultCache(cache_max_bytes, cache_ttl_s)
+
+        # Decoding workers default to cpus this process can run on(may be pinned by model inferer), instead of all
+        # cpus of the host, to avoid oversubscribing cpu together with model inferer threads.
+        preprocess_workers = args.get('preprocess_workers') if args else None
+        if preprocess_workers is None:
+            preprocess_workers = len(os.sched_getaffinity(0))
+        elif type(preprocess_workers) is not int or preprocess_workers <= 0:
+            raise ValueError('Invalid preprocess_workers: {}, should be positive int.'.format(preprocess_workers))
+        self.__batch_tp.shutdown()
+        self.__batch_tp = ThreadPoolExecutor(max_workers=preprocess_workers)
+        clogger.info('your converter preprocess workers: {}, cpu affinity: {}'.format(
+            preprocess_workers, sorted(os.sched_getaffinity(0))))
+
+        # Normalize params, created once instead of per image.
+        self.__mean = torch.tensor([0.485, 0.456, 0.406]).to(self.__device).view(1, 3, 1, 1)
+        self.__std = torch.tensor([0.229, 0.224, 0.225]).to(self.__device).view(1, 3, 1, 1)
+
+    @staticmethod
+    def __inp_device(model_desc):
+        """Device of model inferer input, normalized the same way as TorchModelInferer.init."""
+        device = str(model_desc.get('device', '')).lower()
+        if device == 'original':
+            device = str(model_desc.get('inp_device', '')).lower()
+        if device == 'cpu':
+            return 'cpu'
+        elif device in ['cuda', 'gpu']:
+            return 'cuda:0'
+        elif re.match('^(cuda|gpu):\\d+$', device):
+            return 'cuda:' + device.split(':')[1]
+        raise ValueError('Invalid device: {}, should be cpu, cuda, gpu, cuda:[num], gpu:[num] or original with valid '
+                         'inp_device.'.format(model_desc.get('device')))
+
+    def __decode(self, img_data):
+        """Decode image and resize to 224x224, returns [1, 3, 224, 224] float tensor on device of model inferer."""
+        img = cv2.imdecode(np.frombuffer(img_data, np.uint8), cv2.IMREAD_COLOR)
+        if img is None:
+            raise ValueError('Invalid image data, decode failed.')
+        img = torch.from_numpy(img).to(self.__device)
+        img = img.float().div(255)
+        img = img.permute(2, 0, 1).unsqueeze(0)
+        img = torch.nn.functional.interpolate(img, size=(224, 224), mode='bilinear')
+        return img
+
+    def __normalize(self, imgs):
+        """
+        Normalize [n, 3, 224, 224] images with imagenet mean and std, and convert to precision and memory format of
+        model inferer.
+        """
+        imgs = imgs.sub(self.__mean).div(self.__std)
+        return imgs.to(self.__dtype).contiguous(memory_format=self.__memory_format)
+
+    def __monitor_batch_preprocess(self, batch_size, deduped, begin, contexts):
+        """
+        Monitor batch size, batch fill ratio, deduplicated count and preprocess latency, will be shown in
+        /grps/v1/monitor/metrics.
+        """
+        if not self.__metrics_prefix:
+            return
+        end = time.time()
+        app_monitor.avg(self.__metrics_prefix + '_batch_size_avg', batch_size)
+        app_monitor.cdf(self.__metrics_prefix + '_batch_size_cdf', batch_size)
+        if self.__max_batch_size:
+            app_monitor.avg(self.__metrics_prefix + '_batch_fill_ratio(%)', batch_size * 100 / self.__max_batch_size)
+        if deduped:
+            app_monitor.inc(self.__metrics_prefix + '_batch_dedup', deduped)
+        app_monitor.avg(self.__metrics_prefix + '_preprocess_latency_avg(ms)', (end - begin) * 1e3)
+        for context in contexts:
+            context.put_user_data('preprocess_end', end)
+
+    def __monitor_batch_postprocess(self, begin, contexts):
+        """Monitor model infer and postprocess latency, will be shown in /grps/v1/monitor/metrics."""
+        if not self.__metrics_prefix:
+            return
+        app_monitor.avg(self.__metrics_prefix + '_infer_latency_avg(ms)',
+                        (begin - contexts[0].get_user_data('preprocess_end')) * 1e3)
+        app_monitor.avg(self.__metrics_prefix + '_postprocess_latency_avg(ms)', (time.time() - begin) * 1e3)
+
+    def __monitor_cache(self, hits=0, misses=0, evictions=0):
+        """Monitor result cache hit, miss and eviction count, will be shown in /grps/v1/monitor/metrics."""
+        if not self.__metrics_prefix:
+            return
+        for name, count in (('hit', hits), ('miss', misses), ('eviction', evictions)):
+            if count:
+                app_monitor.inc('{}_result_cache_{}'.format(self.__metrics_prefix, name), count)
+
     def preprocess(self, inp: GrpsMessage, context: GrpsContext):
         """
         Preprocess.
@@ -54,22 +252,8 @@ class YourConverter(Converter):
             Exception: If preprocess failed, can raise exception and exception will be caught by server and return error
             message to client.
         """
-        img_data = inp.bin_data
-        img = cv2.imdecode(np.frombuffer(img_data, np.uint8), cv2.IMREAD_COLOR)
-        img = torch.from_numpy(img).to('cuda')
-        img = img.float().div(255)
-        img = img.permute(2, 0, 1).unsqueeze(0)
-        img = torch.nn.functional.interpolate(img, size=(224, 224), mode='bilinear')
-        # normalize
-        mean = torch.tensor([0.485, 0.456, 0.406]).to('cuda')
-        std = torch.tensor([0.229, 0.224, 0.225]).to('cuda')
-        channels = torch.split(img, 1, 1)
-        channels_list = list(channels)
-        for i in range(3):
-            channels_list[i] = channels_list[i].sub(mean[i]).div(std[i])
-        channels = tuple(channels_list)
-        img = torch.cat(channels, 1)
-        return img
+        img = self.__decode(inp.bin_data)
+        return self.__normalize(img)
 
     def postprocess(self, inp, context: GrpsContext) -> GrpsMessage:
         """
@@ -83,8 +267,8 @@ class YourConverter(Converter):
             Post-processed data with GrpsMessage format to client or next model(multi model sequential mode).
 
         Raises:
-            Exception: If postprocess failed, can raise exception and exception will be caught by server and return error
-            message to client.
+            Exception: If postprocess failed, can raise exception and exception will be caught by server and return
+            error message to client.
         """
         label = np.argmax(inp.cpu().detach().numpy()[0])
         out = GrpsMessage(str_data=self.__synset[label].replace('\n', ''))
@@ -105,32 +289,57 @@ class YourConverter(Converter):
             Exception: If preprocess failed, can raise exception and exception will be caught by server and return error
             message to client.
         """
-        imgs_futures = []
-
-        def decode_fn(img_data):
-            img = cv2.imdecode(np.frombuffer(img_data, np.uint8), cv2.IMREAD_COLOR)
-            img = torch.from_numpy(img).to('cuda')
-            img = img.float().div(255)
-            img = img.permute(2, 0, 1).unsqueeze(0)
-            img = torch.nn.functional.interpolate(img, size=(224, 224), mode='bilinear')
-            # normalize
-            mean = torch.tensor([0.485, 0.456, 0.406]).to('cuda')
-            std = torch.tensor([0.229, 0.224, 0.225]).to('cuda')
-            channels = torch.split(img, 1, 1)
-            channels_list = list(channels)
-            for i in range(3):
-                channels_list[i] = channels_list[i].sub(mean[i]).div(std[i])
-            channels = tuple(channels_list)
-            img = torch.cat(channels, 1)
-            return img
-
-        for inp in inps:
+        begin = time.time()
+        imgs_futures = {}  # Image data -> (contexts, decode future).
+
+        for inp, context in zip(inps, contexts):
+            # Client has cancelled or grpc deadline has been exceeded, skip it to avoid wasting decode and infer.
+            if context.if_disconnected():
+                clogger.warning('your converter batch_preprocess, drop request whose client has disconnected.')
+                context.set_err_msg('Client disconnected or deadline exceeded before preprocess.')
+                continue
+            if self.__result_cache:
+                cache_key = ResultCache.key(inp.bin_data)
+                cached_out, evicted = self.__result_cache.get(cache_key)
+                if cached_out is not None:  # Repeated image, skip decode and infer.
+                    self.__monitor_cache(hits=1)
+                    context.put_user_data('cached_out', cached_out)
+                    continue
+                self.__monitor_cache(misses=1, evictions=evicted)
+                context.put_user_data('cache_key', cache_key)
             img_data = inp.bin_data
-            imgs_futures.append(self.__batch_tp.submit(decode_fn, img_data))
+            if img_data in imgs_futures:  # Identical image in the same batch, decode and infer only once.
+                imgs_futures[img_data][0].append(context)
+                continue
+            imgs_futures[img_data] = ([context], self.__batch_tp.submit(self.__decode, img_data))
+
+        # Only fail the requests whose image is bad, other requests in the batch continue.
+        imgs = []
+        for img_contexts, future in imgs_futures.values():
+            try:
+                img = future.result()
+            except Exception:
+                err_msg = traceback.format_exc()
+                clogger.error('your converter batch_preprocess, decode image failed: {}'.format(err_msg))
+                for context in img_contexts:
+                    context.set_err_msg('Decode image failed: {}'.format(err_msg))
+                continue
+            for context in img_contexts:  # Identical images share one row of the batch.
+                context.put_user_data('batch_idx', len(imgs))
+            imgs.append(img)
 
-        imgs = [future.result() for future in imgs_futures]
+        deduped = sum(len(img_contexts) - 1 for img_contexts, _ in imgs_futures.values())
+        if not imgs:
+            if all(context.has_err() for context in contexts):  # All requests have been dropped or failed.
+                return None
+            # All remaining requests hit result cache, return None as marker so that model inferer skips running model.
+            self.__monitor_batch_preprocess(len(inps), deduped, begin, contexts)
+            return None
 
-        return torch.cat(imgs, 0)
+        # Normalize the whole batch at once instead of per image.
+        imgs = self.__normalize(torch.cat(imgs, 0))
+        self.__monitor_batch_preprocess(len(inps), deduped, begin, contexts)
+        return imgs
 
     def batch_postprocess(self, inp, contexts: list) -> list:
         """
@@ -147,11 +356,31 @@ class YourConverter(Converter):
             Exception: If postprocess failed, can raise exception and exception will be caught by server and return
             error message to client.
         """
-        labels = np.argmax(inp.cpu().detach().numpy(), axis=1)
+        begin = time.time()
+        # Inp is None when all requests of batch hit result cache.
+        labels = np.argmax(inp.cpu().detach().numpy(), axis=1) if inp is not None else None
         outs = []
-        for label in labels:
-            out = GrpsMessage(str_data=self.__synset[label].replace('\n', ''))
+        for context in contexts:
+            if context.has_err():  # Dropped or failed in batch_preprocess.
+                outs.append(None)
+                continue
+            cached_out = context.get_user_data('cached_out')
+            if cached_out is not None:
+                outs.append(GrpsMessage(str_data=cached_out))
+                continue
+            try:
+                label = labels[context.get_user_data('batch_idx')]
+                out = GrpsMessage(str_data=self.__synset[label].replace('\n', ''))
+                if self.__result_cache:
+                    evicted = self.__result_cache.put(context.get_user_data('cache_key'), out.str_data)
+                    self.__monitor_cache(evictions=evicted)
+            except Exception:  # Only fail this request, other requests in the batch continue.
+                err_msg = traceback.format_exc()
+                clogger.error('your converter batch_postprocess failed: {}'.format(err_msg))
+                context.set_err_msg('Postprocess failed: {}'.format(err_msg))
+                out = None
             outs.append(out)
+        self.__monitor_batch_postprocess(begin, contexts)
         return outs
 
 
@@ -0,0 +1,216 @@
+# Copyright 2022 netease. All rights reserved.
+# Author zhaochaochao@corp.netease.com
+# Date   2023/9/5
+# Brief  Customized deep learning model inferer. Including model load and model infer.
+import hashlib
+import os
+import time
+
+import torch
+from grps_framework.logger.logger import clogger
+from grps_framework.model_infer.inferer import inferer_register
+from grps_framework.model_infer.torch_inferer import TorchModelInferer
+
+
+class YourInferer(TorchModelInferer):
+    """
+    Torch script model inferer which can run model in configured precision and memory format, and optimize model for
+    inference with optimized model cached on disk.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.__optimize = False
+        self.__optimize_cache_dir = './data/optimized'
+        self.__precision = 'fp32'
+        self.__dtype = torch.float32
+        self.__memory_format = torch.contiguous_format
+
+    def init(self, path, device=None, args=None):
+        """
+        Initiate model inferer class with model path and device.
+
+        Args:
+            path: Model path, it can be a file path or a directory path.
+            device: Device to run model.
+            args: More args.
+
+        Raises:
+            Exception: If init failed, can raise exception. Will be caught by server and show error message to user when
+            start service.
+        """
+        super(YourInferer, self).init(path, device, args)
+        args = args or {}
+        self.__optimize = args.get('optimize', self.__optimize)
+        if type(self.__optimize) is not bool:
+            raise ValueError('Invalid optimize: {}, should be bool.'.format(self.__optimize))
+        self.__optimize_cache_dir = args.get('optimize_cache_dir', self.__optimize_cache_dir)
+        if self.__optimize and self._device == 'original':
+            raise ValueError('Invalid device: original, should specify device when optimize is enabled.')
+
+        # Dynamic int8 only quantizes linear layers, which is not worth for conv models like resnet.
+        self.__precision = args.get('precision', self.__precision)
+        if self.__precision not in ['fp32', 'bf16']:
+            raise ValueError('Invalid precision: {}, should be fp32 or bf16.'.format(self.__precision))
+        if self.__precision == 'bf16':
+            if self._device != 'cpu':
+                raise ValueError('Invalid precision: bf16, only supported when device is cpu.')
+            self.__dtype = torch.bfloat16
+        memory_format = args.get('memory_format', 'contiguous')
+        if memory_format == 'channels_last':
+            self.__memory_format = torch.channels_last
+        elif memory_format != 'contiguous':
+            raise ValueError('Invalid memory_format: {}, should be contiguous or channels_last.'.format(memory_format))
+
+        # Thread budget and cpu pinning. Torch thread pools are process wide. Cpu affinity is per thread on linux, so
+        # pin every existing thread(like monitor and mpi threads started before model init), threads created
+        # later(batcher, converter workers) inherit the affinity.
+        intra_op_threads = args.get('intra_op_threads')
+        inter_op_threads = args.get('inter_op_threads')
+        cpu_affinity = args.get('cpu_affinity')
+        for name, threads in (('intra_op_threads', intra_op_threads), ('inter_op_threads', inter_op_threads)):
+            if threads is not None and (type(threads) is not int or threads <= 0):
+                raise ValueError('Invalid {}: {}, should be positive int.'.format(name, threads))
+        if cpu_affinity is not None:
+            if type(cpu_affinity) is not list or not cpu_affinity or \
+                    any(type(cpu) is not int or cpu < 0 for cpu in cpu_affinity):
+                raise ValueError('Invalid cpu_affinity: {}, should be list of cpu ids.'.format(cpu_affinity))
+            for tid in os.listdir('/proc/self/task'):
+                try:
+                    os.sched_setaffinity(int(tid), cpu_affinity)
+                except ProcessLookupError:  # Thread has exited.
+                    pass
+        if intra_op_threads:
+            torch.set_num_threads(intra_op_threads)
+        if inter_op_threads:
+            torch.set_num_interop_threads(inter_op_threads)
+        clogger.info('your infer thread topology, cpu count: {}, cpu affinity: {}, intra-op threads: {}, '
+                     'inter-op threads: {}'.format(os.cpu_count(), sorted(os.sched_getaffinity(0)),
+                                                   torch.get_num_threads(), torch.get_num_interop_threads()))
+        clogger.info('your infer init, path: {}, device: {}, args: {}.'.format(path, device, args))
+
+    def __cache_path(self):
+        """
+        Path of cached frozen model, keyed by md5 of model file, torch version, device, precision and memory format.
+        """
+        md5 = hashlib.md5()
+        with open(self._path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1 << 20), b''):
+                md5.update(chunk)
+        name = '{}_torch{}_{}_{}_{}.pt'.format(md5.hexdigest(), torch.__version__, self._device.replace(':', ''),
+                                               self.__precision, str(self.__memory_format).split('.')[-1])
+        return os.path.join(self.__optimize_cache_dir, name)
+
+    def __convert(self):
+        """Convert model to configured precision and memory format."""
+        if self.__precision == 'bf16':
+            self._model.to(torch.bfloat16)
+        if self.__memory_format == torch.channels_last:
+            self._model.to(memory_format=torch.channels_last)
+
+    @staticmethod
+    def __optimize_for_inference(model):
+        """
+        Apply inference passes if torch supports. Not cached, since passes may insert ops (like mkldnn conversion) that
+        do not survive saving and loading, so it is applied after every load.
+        """
+        if hasattr(torch.jit, 'optimize_for_inference'):  # Since torch 1.10.
+            model = torch.jit.optimize_for_inference(model)
+        return model
+
+    def __save_cache(self, cache_path):
+        """Save frozen model to cache, failure only loses cache, so only warns instead of failing load."""
+        tmp_path = '{}.{}.tmp'.format(cache_path, os.getpid())
+        try:
+            os.makedirs(self.__optimize_cache_dir, exist_ok=True)
+            torch.jit.save(self._model, tmp_path)
+            os.replace(tmp_path, cache_path)  # Atomic, other process will not load half written model.
+        except Exception as e:
+            clogger.warning('your inferer save frozen model to cache: {} failed: {}'.format(cache_path, e))
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            return False
+        return True
+
+    def load(self):
+        """
+        Load model from model path.
+
+        Returns:
+            True if load model successfully, otherwise False.
+
+        Raises:
+            Exception: If load failed, can raise exception and exception will be caught by server and show error message
+            to user when start service.
+        """
+        if not self.__optimize:
+            if not TorchModelInferer.load(self):
+                return False
+            self.__convert()
+            return True
+
+        begin = time.time()
+        cache_path = self.__cache_path()
+        if os.path.exists(cache_path):
+            self._model = torch.jit.load(cache_path, map_location=self._device)
+            self._model = self.__optimize_for_inference(self._model)
+            clogger.info('your inferer load frozen model from cache: {}, time: {:.0f} ms'.format(
+                cache_path, (time.time() - begin) * 1e3))
+            return True
+
+        if not TorchModelInferer.load(self):
+            return False
+        self.__convert()
+        # Freeze(inline parameters and fold constants) and cache frozen model only.
+        self._model = torch.jit.freeze(self._model)
+        saved = self.__save_cache(cache_path)
+        self._model = self.__optimize_for_inference(self._model)
+        clogger.info('your inferer optimize model, cache: {}, saved: {}, time: {:.0f} ms'.format(
+            cache_path, saved, (time.time() - begin) * 1e3))
+        return True
+
+    def infer(self, tensors, context):
+        """
+        The inference function is used to make a prediction call on the given input request.
+
+        Args:
+            context: grps context
+            tensors: Model infer input, which is output of converter preprocess function.
+
+        Returns:
+            Model infer output, which will be input of converter postprocess function.
+
+        Raises:
+            Exception: If infer failed, can raise exception and exception will be caught by server and return error
+            message to client.
+        """
+        if isinstance(tensors, torch.Tensor):  # No copy if converter has produced matching input.
+            tensors = tensors.to(self._inp_device, self.__dtype, memory_format=self.__memory_format)
+        out = TorchModelInferer.infer(self, tensors, context)
+        if isinstance(out, torch.Tensor) and out.dtype == torch.bfloat16:
+            out = out.float()  # Numpy used by converter postprocess does not support bf16.
+        return out
+
+    def batch_infer(self, inp, contexts: list):
+        """
+        Batch infer.
+
+        Args:
+            inp: Model infer input, which is output of converter batch_preprocess function. None when all requests of
+            batch hit result cache of converter, model will not run.
+            contexts: Grps context list.
+
+        Returns:
+            Model infer output, which will be input of converter batch_postprocess function.
+
+        Raises:
+            Exception: If batch infer failed, can raise exception and exception will be caught by server and return
+            error message to client.
+        """
+        if inp is None:  # All requests hit result cache of converter.
+            return None
+        return TorchModelInferer.batch_infer(self, inp, contexts)
+
+
+# Register
+inferer_register.register('your_inferer', YourInferer())
@@ -2,12 +2,17 @@
 # Author zhaochaochao@corp.netease.com
 # Date   2023/9/5
 # Brief  Local unittest.
+import sys
+import time
 import unittest
+from concurrent.futures import ThreadPoolExecutor
 
 from grps_framework.context.context import GrpsContext
 from grps_framework.test import GrpsTest
 from grps_framework.apis.grps_pb2 import GrpsMessage, GenericTensor, DataType
 import src.customized_converter
+from src.customized_converter import ResultCache
+import src.customized_inferer
 
 
 class MyTestCase(GrpsTest):
@@ -36,9 +41,57 @@ class MyTestCase(GrpsTest):
         # self.assertEqual(grps_out.gTensors.tensors[0], gtensor)
         self.assertEqual(grps_out.str_data, 'tabby')
 
+    def test_concurrent_infer_with_bad_image(self):
+        self.test_init()
+
+        with open('./data/tabby.jpeg', 'rb') as f:
+            img_data = f.read()
+
+        # Concurrent requests will be batched together, only the request with bad image should fail.
+        def infer_fn(i):
+            grps_in = GrpsMessage(bin_data=b'not an image' if i == 0 else img_data)
+            context = GrpsContext()
+            grps_out = self.executor.infer(grps_in, context)
+            return context, grps_out
+
+        with ThreadPoolExecutor(max_workers=8) as tp:
+            results = list(tp.map(infer_fn, range(8)))
+
+        for i, (context, grps_out) in enumerate(results):
+            if i == 0:
+                self.assertEqual(context.has_err(), True)
+            else:
+                self.assertEqual(context.has_err(), False)
+                self.assertEqual(grps_out.str_data, 'tabby')
+
+    def test_result_cache(self):
+        # Hit.
+        key = ResultCache.key(b'image')
+        cache = ResultCache(max_bytes=1024, ttl_s=0.1)
+        self.assertEqual(cache.put(key, 'tabby'), 0)
+        self.assertEqual(cache.get(key), ('tabby', 0))
+
+        # Ttl expiry, expired item is evicted when got.
+        time.sleep(0.2)
+        self.assertEqual(cache.get(key), (None, 1))
+        self.assertEqual(cache.get(key), (None, 0))
+
+        # Byte bound eviction, least recently used item is evicted first.
+        keys = [ResultCache.key(str(i).encode()) for i in range(3)]
+        cache = ResultCache(max_bytes=(sys.getsizeof(keys[0]) + sys.getsizeof('tabby')) * 2, ttl_s=600)
+        self.assertEqual(cache.put(keys[0], 'tabby'), 0)
+        self.assertEqual(cache.put(keys[1], 'tabby'), 0)
+        self.assertEqual(cache.get(keys[0]), ('tabby', 0))  # keys[1] becomes least recently used.
+        self.assertEqual(cache.put(keys[2], 'tabby'), 1)
+        self.assertEqual(cache.get(keys[1]), (None, 0))
+        self.assertEqual(cache.get(keys[0]), ('tabby', 0))
+        self.assertEqual(cache.get(keys[2]), ('tabby', 0))
+
 
 if __name__ == '__main__':
     suite = unittest.TestSuite()
     suite.addTest(MyTestCase('test_infer'))
+    suite.addTest(MyTestCase('test_concurrent_infer_with_bad_image'))
+    suite.addTest(MyTestCase('test_result_cache'))
     runner = unittest.TextTestRunner()
     runner.run(suite)
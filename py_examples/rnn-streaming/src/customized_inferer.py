@@ -2,7 +2,11 @@
 # Author zhaochaochao@corp.netease.com
 # Date   2023/9/5
 # Brief  Customized deep learning model inferer. Including model load and model infer.
+import threading
 import time
+import traceback
+from queue import Empty, Queue
+
 import torch
 import numpy as np
 from grps_framework.apis import grps_pb2
@@ -13,10 +17,28 @@ from grps_framework.model_infer.torch_inferer import TorchModelInferer
 
 
 class YourInferer(TorchModelInferer):
+    class Sequence:
+        """Generating sequence of one request."""
+
+        def __init__(self, inp_s, index_list, hidden, context):
+            self.inp_s = inp_s
+            self.predicted_word = inp_s
+            self.index_list = index_list
+            self.hidden = hidden
+            self.context = context
+            self.steps = 0
+            self.out = None
+            self.err = None
+            self.done = threading.Event()
+
     def __init__(self):
+        super().__init__()
         self.word_to_ix = {}
         self.ix_to_word = {}
         self.pred_len = 0
+        self.max_active_seqs = 32
+        self.__pending_seqs = Queue()
+        self.__schedule_thread = None
 
     def init(self, path, device=None, args=None):
         """
@@ -33,6 +55,11 @@ class YourInferer(TorchModelInferer):
         """
         super(YourInferer, self).init(path, device, args)
         self.pred_len = args['pred_length']
+        if type(self.pred_len) is not int or self.pred_len <= 0:
+            raise ValueError('Invalid pred_length: {}, should be positive int.'.format(self.pred_len))
+        self.max_active_seqs = args.get('max_active_seqs', self.max_active_seqs)
+        if type(self.max_active_seqs) is not int or self.max_active_seqs <= 0:
+            raise ValueError('Invalid max_active_seqs: {}, should be positive int.'.format(self.max_active_seqs))
         clogger.info('your infer init, path: {}, device: {}, args: {}.'.format(path, device, args))
 
     def load(self):
@@ -52,9 +79,119 @@ class YourInferer(TorchModelInferer):
                 self.word_to_ix[word] = int(index)
                 self.ix_to_word[int(index)] = word
         TorchModelInferer.load(self)
+
+        # Start continuous batching schedule thread.
+        if self.__schedule_thread is None:
+            self.__schedule_thread = threading.Thread(target=self.__schedule)
+            self.__schedule_thread.setDaemon(True)
+            self.__schedule_thread.start()
         clogger.info('your inferer load.')
         return True
 
+    def __step(self, inp, hidden):
+        """
+        One step forward of all active sequences together. Same as forward of the rnn model, but not limited to batch
+        size 1.
+
+        Args:
+            inp: Word indexes with [batch_size, 2] shape.
+            hidden: Hidden states with [1, batch_size, 100] shape.
+
+        Returns:
+            Output with [batch_size, vocab_size] shape and hidden states with [1, batch_size, 100] shape.
+        """
+        batch_size = inp.size(0)
+        inp = self._model.encoder(inp).view(batch_size, 1, -1)
+        gru = self._model.gru
+        output, hidden = torch.gru(inp, hidden, [gru.weight_ih_l0, gru.weight_hh_l0, gru.bias_ih_l0, gru.bias_hh_l0],
+                                   True, 1, 0., False, False, True)
+        output = self._model.decoder(output.view(batch_size, -1))
+        return output, hidden
+
+    @staticmethod
+    def __finish(seq, err=None):
+        """Finish sequence and wake up its infer call. Done is always set, even if sending the last word fails."""
+        try:
+            if seq.context.if_streaming():  # Send the last predicted word to client.
+                seq.context.stream_respond(grps_pb2.GrpsMessage(str_data=seq.predicted_word))
+        except Exception:  # Like client has disconnected.
+            err = err or traceback.format_exc()
+            clogger.error('your inferer send last word failed, error: {}'.format(traceback.format_exc()))
+        finally:
+            seq.out = grps_pb2.GrpsMessage(str_data=seq.inp_s)
+            seq.err = err
+            seq.done.set()
+
+    def __step_all(self, seqs):
+        """Step all active sequences with one forward, returns sequences that have not finished."""
+        running = []
+        for seq in seqs:
+            if seq.context.if_streaming():  # If streaming, send predicted word to client
+                if seq.context.if_disconnected():
+                    self.__finish(seq)
+                    continue
+                seq.context.stream_respond(grps_pb2.GrpsMessage(str_data=seq.predicted_word))
+            running.append(seq)
+        if not running:
+            return []
+
+        begin = time.time()
+        with torch.no_grad():
+            inp = torch.as_tensor(np.array([seq.index_list for seq in running]), dtype=torch.long)
+            inp = inp.to(self._inp_device)
+            hidden = torch.cat([seq.hidden for seq in running], 1)
+            output, hidden = self.__step(inp, hidden)
+
+            # Sample from the network as a multinomial distribution
+            output_dist = output.data.div(1).exp()
+            top_i = torch.multinomial(output_dist, 1).view(-1).tolist()
+        clogger.debug('your inferer step, active sequences: {}, step time: {:.0f} us'.format(
+            len(running), (time.time() - begin) * 1e6))
+
+        unfinished = []
+        for i, seq in enumerate(running):
+            # Add predicted word to string and use as next input
+            seq.hidden = hidden[:, i:i + 1, :]
+            seq.predicted_word = self.ix_to_word[top_i[i]]
+            seq.index_list = [seq.index_list[1], top_i[i]]
+            if not seq.context.if_streaming():
+                seq.inp_s += " " + seq.predicted_word
+
+            seq.steps += 1
+            if seq.steps >= self.pred_len:
+                self.__finish(seq)
+            else:
+                unfinished.append(seq)
+        return unfinished
+
+    def __schedule(self):
+        """
+        Continuous batching schedule. All active sequences are stepped together, and new sequences are admitted between
+        steps, so concurrent streams share one forward and new stream does not wait for others finishing.
+        """
+        active_seqs = []
+        while True:
+            if not active_seqs:  # Idle, wait for new sequence.
+                active_seqs.append(self.__pending_seqs.get())
+            try:
+                while len(active_seqs) < self.max_active_seqs:
+                    active_seqs.append(self.__pending_seqs.get_nowait())
+            except Empty:
+                pass
+
+            try:
+                active_seqs = self.__step_all(active_seqs)
+            except Exception:
+                trace_back = traceback.format_exc()
+                clogger.error('your inferer step failed, error: {}'.format(trace_back))
+                for seq in active_seqs:
+                    if not seq.done.is_set():
+                        try:  # Failing of one sequence should not kill schedule thread.
+                            self.__finish(seq, trace_back)
+                        except Exception:
+                            seq.done.set()
+                active_seqs = []
+
     def infer(self, inp, context: GrpsContext):
         """
         The inference function is used to make a prediction call on the given input request.
@@ -72,39 +209,20 @@ class YourInferer(TorchModelInferer):
             Exception: If infer failed, can raise exception and exception will be caught by server and return error
             message to client.
         """
-        # Prepare first input tensor.
+        # Prepare first input.
         inp_s = inp.str_data
-        predicted_word = inp_s
-        hidden = torch.zeros(1, 1, 100)
-        index_list = np.array([self.word_to_ix[w] for w in inp_s.split()])
+        index_list = [self.word_to_ix[w] for w in inp_s.split()]
         if len(index_list) != 2:
             raise Exception('input length must be 2')
-        inp = torch.as_tensor(index_list[-2:], dtype=torch.long)
-
-        for p in range(self.pred_len):
-            if context.if_streaming():  # If streaming, send predicted word to client
-                if context.if_disconnected():
-                    break
-                context.stream_respond(grps_pb2.GrpsMessage(str_data=predicted_word))
-
-            output, hidden = TorchModelInferer.infer(self, [inp, hidden], context)
-
-            # Sample from the network as a multinomial distribution
-            output_dist = output.data.view(-1).div(1).exp()
-            top_i = torch.multinomial(output_dist, 1)[0]
-
-            # Add predicted word to string and use as next input
-            predicted_word = self.ix_to_word[top_i.item()]
-            index_list[0] = index_list[1]
-            index_list[1] = top_i
-
-            if not context.if_streaming():
-                inp_s += " " + predicted_word
-
-        if context.if_streaming():  # Send the last predicted word to client.
-            context.stream_respond(grps_pb2.GrpsMessage(str_data=predicted_word))
-
-        return grps_pb2.GrpsMessage(str_data=inp_s)
+        hidden = torch.zeros(1, 1, 100).to(self._inp_device)
+
+        # Generate with other active sequences together in schedule thread.
+        seq = YourInferer.Sequence(inp_s, index_list, hidden, context)
+        self.__pending_seqs.put(seq)
+        seq.done.wait()
+        if seq.err:
+            raise Exception(seq.err)
+        return seq.out
 
 
 # Register
@@ -3,6 +3,7 @@
 # Date   2023/9/5
 # Brief  Local unittest.
 import unittest
+from concurrent.futures import ThreadPoolExecutor
 
 from grps_framework.apis.grps_pb2 import GrpsMessage
 from grps_framework.context.context import GrpsContext
@@ -30,9 +31,27 @@ class MyTestCase(GrpsTest):
         # Check your result as follows:
         #self.assertEqual(grps_out.str_data, 'this process however afforded mean')
 
+    def test_concurrent_infer(self):
+        self.test_init()
+
+        # Concurrent requests will be generated together.
+        def infer_fn(_):
+            grps_in = GrpsMessage(str_data='this process')
+            context = GrpsContext()
+            grps_out = self.executor.infer(grps_in, context)
+            self.assertEqual(context.has_err(), False)
+            return grps_out
+
+        with ThreadPoolExecutor(max_workers=8) as tp:
+            grps_outs = list(tp.map(infer_fn, range(8)))
+
+        for grps_out in grps_outs:
+            self.assertEqual(len(grps_out.str_data.split()), 2 + 3)  # input words + pred_length words.
+
 
 if __name__ == '__main__':
     suite = unittest.TestSuite()
     suite.addTest(MyTestCase('test_infer'))
+    suite.addTest(MyTestCase('test_concurrent_infer'))
     runner = unittest.TextTestRunner()
     runner.run(suite)